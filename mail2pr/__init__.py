@@ -1,57 +1,116 @@
-from email.parser import BytesParser
+from email.parser import BytesHeaderParser
+import email.policy
 from pathlib import Path
 import subprocess
-import shutil
 import logging
 import argparse
 import os
-import cmd
+import re
+import io
+import mmap
+import stat
+import textwrap
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import BinaryIO, Union
 from tempfile import TemporaryDirectory, NamedTemporaryFile
 
-from .utils import slugify_subject, create_cache_directory, sh, trim_subject
+try:
+    import readline
+except ImportError:
+    readline = None
+
+from .utils import slugify_subject, create_cache_directory, sh, trim_subject, \
+    remove_tree_in_background
+
+
+# shared between all worktrees so that background git calls reuse threads
+_EXECUTOR = ThreadPoolExecutor(max_workers=4)
+
+# parsers are stateless between calls, no need to build one per mail
+_HEADER_PARSER = BytesHeaderParser(policy=email.policy.default)
+_HEADER_END_RE = re.compile(rb"\r?\n\r?\n")
+
+
+def _map_file(file) -> Union[bytes, mmap.mmap]:
+    """
+    Return the contents of the given file, memory mapped if it is a regular
+    file so that large mails are paged in on demand instead of copied.
+    """
+    try:
+        fd = file.fileno()
+        st = os.fstat(fd)
+    except (AttributeError, OSError):
+        return file.read()
+
+    # empty files can't be mapped
+    if not stat.S_ISREG(st.st_mode) or st.st_size == 0:
+        return file.read()
+
+    return mmap.mmap(fd, 0, access=mmap.ACCESS_READ)
 
 
 class Mail:
     def __init__(self, file):
-        self.email = BytesParser().parse(file)
+        # Only the headers are ever inspected, the body is handed to `git am`
+        # verbatim. Keep the raw bytes around and skip parsing the (possibly
+        # huge) MIME body entirely.
+        self._raw = _map_file(file)
+        # Even in headers only mode the parser decodes and splits the whole
+        # message into lines, only hand it the part up to the first blank line.
+        end = _HEADER_END_RE.search(self._raw)
+        self._headers = _HEADER_PARSER.parsebytes(self._raw[:end.end() if end else None])
 
     @property
     def message_id(self):
         """
         Return the message id as written in the mail header.
         """
-        return self.email['message-id']
+        return self._headers['message-id']
 
     @property
     def archive_url(self):
         """
         Return the archive url of the message
         """
-        url = self.email['Archived-At']
+        url = self._headers['Archived-At']
         if url:
             url = url.lstrip('<').rstrip('>')
 
         return url
 
-    @property
+    @functools.cached_property
     def subject(self):
         """
         Return the subject without the [PATCH], Re:, … part
         """
-        subject = self.email['subject']
+        subject = self._headers['subject']
         return trim_subject(subject)
 
-    @property
+    @functools.cached_property
     def slug(self):
         """
         Return a slugified version of the mail's subject to be used as Git
         branch name.
         """
-        subject = self.email['subject']
+        subject = self._headers['subject']
         return slugify_subject(subject)
 
-    def as_bytes(self):
-        return self.email.as_bytes()
+    def as_bytes(self) -> bytes:
+        """
+        Return the raw mail. This copies the whole mail into memory, prefer
+        `open_bytes` to pass it on.
+        """
+        return bytes(self._raw)
+
+    def open_bytes(self) -> BinaryIO:
+        """
+        Return a file object over the raw mail, e.g. to stream it into `git am`.
+        """
+        if isinstance(self._raw, mmap.mmap):
+            self._raw.seek(0)
+            return self._raw
+        return io.BytesIO(self._raw)
 
 
 class GitAMFailed(Exception):
@@ -74,27 +133,31 @@ class Worktree:
         self.github_user = github_user
         self.github_org = github_org
         self.github_repo = github_repo
+        self.repo_path = repo_path
+        self.branch_name = f"ml2pr/{self.mail.slug}"
+
+        # The fetch is network bound and independent of the local directory
+        # setup below, start it right away and collect the result in setup().
+        self._fetch_future = _EXECUTOR.submit(
+            sh, ["git", "-C", self.repo_path, "fetch", "origin",
+                 f"+{self.base_branch}:refs/heads/{self.branch_name}",
+                 f"+{self.base_branch}:refs/base-{self.branch_name}"])
+
         self._tempdir = create_cache_directory(name=mail.slug)
         if isinstance(self._tempdir, TemporaryDirectory):
             self.path = Path(self._tempdir.name)
         else:
             self.path = self._tempdir
 
-        self.branch_name = f"ml2pr/{self.mail.slug}"
-
-        self.repo_path = repo_path
         self.worktree = self.path / "repo"
         self.worktree.mkdir()
 
     def setup(self):
         try:
-            sh(["git", "-C", self.repo_path, "fetch", "origin", f"{self.base_branch}:refs/base-{self.branch_name}"])
+            self._fetch_future.result()
         except Exception as e:
             raise GitFetchFailed(e)
 
-        sh(["git", "-C", self.repo_path, "branch", "-f", self.branch_name,
-            f"refs/base-{self.branch_name}"])
-
         try:
             sh(["git", "-C", self.repo_path, "worktree", "add", str(self.worktree),
                 self.branch_name])
@@ -102,15 +165,14 @@ class Worktree:
             raise GitFetchFailed(e)
 
         try:
-            b = self.mail.as_bytes()
             sh(["git", "am", "--message-id", "-"],
                cwd=self.worktree,
-               input=b)
+               input_file=self.mail.open_bytes())
         except Exception as e:
             raise GitAMFailed(e)
 
     def cleanup(self):
-        shutil.rmtree(str(self.path))
+        remove_tree_in_background(self.path)
         sh(["git", "-C", self.repo_path, "worktree", "prune"])
 
     def __enter__(self):
@@ -156,9 +218,11 @@ class Worktree:
         Create a PR
         """
 
+        subject = self.mail.subject
+        archive_url = self.mail.archive_url
         log = self.log().strip()
 
-        message = f'''{self.mail.subject}
+        message = f'''{subject}
 
 I'm forwarding this patch that I received via email:
 
@@ -166,9 +230,9 @@ I'm forwarding this patch that I received via email:
 {log}
 ```
 '''
-        if self.mail.archive_url:
+        if archive_url:
             message += f'''
-You can find the submission in the [archive]({self.mail.archive_url}).
+You can find the submission in the [archive]({archive_url}).
             '''
 
         res = sh(["git", "push", "-f", f"ssh://git@github.com/{self.github_user}/{self.github_repo}.git", f"{self.branch_name}:{self.branch_name}"], check=False, cwd=self.worktree)
@@ -190,19 +254,88 @@ You can find the submission in the [archive]({self.mail.archive_url}).
                 print("Failed to open PR")
 
 
-class Shell(cmd.Cmd):
+class Shell:
     intro = '''
         Run commands on the applied patches
     '''
+    prompt = '(Cmd) '
 
     def __init__(self, worktree: Worktree, mail: Mail):
-        super().__init__()
         self.mail = mail
         self.worktree = worktree
+        self._cmds = {name[3:]: getattr(self, name) for name in dir(self) if name.startswith('do_')}
 
     def can_exit(self):
         return True
 
+    def complete(self, text, state):
+        """
+        Complete command names, arguments are left alone.
+        """
+        line = readline.get_line_buffer()
+        if readline.get_begidx() > len(line) - len(line.lstrip()):
+            return None
+
+        matches = [name for name in self._cmds if name.startswith(text)]
+        return matches[state] + ' ' if state < len(matches) else None
+
+    def parseline(self, line):
+        """
+        Split the line into command and argument, `?` and `!` are shortcuts
+        for help and shell.
+        """
+        line = line.strip()
+        if line.startswith('?'):
+            line = 'help ' + line[1:]
+        elif line.startswith('!'):
+            line = 'shell ' + line[1:]
+
+        command, _, arg = line.partition(' ')
+        return command, arg.strip()
+
+    def cmdloop(self):
+        """
+        Read commands until one of them asks to stop.
+        """
+        if readline is not None:
+            old_completer = readline.get_completer()
+            readline.set_completer(self.complete)
+            readline.parse_and_bind('tab: complete')
+        try:
+            print(self.intro)
+            while True:
+                try:
+                    line = input(self.prompt)
+                except EOFError:
+                    print()
+                    line = 'EOF'
+
+                command, arg = self.parseline(line)
+                if not command:
+                    continue
+
+                handler = self._cmds.get(command)
+                if handler is None:
+                    print(f"*** Unknown syntax: {line}")
+                    continue
+
+                if handler(arg):
+                    return
+        finally:
+            if readline is not None:
+                readline.set_completer(old_completer)
+
+    def do_help(self, arg):
+        """
+        List available commands or show the help of the given one
+        """
+        if arg in self._cmds:
+            print(textwrap.dedent(self._cmds[arg].__doc__ or '').strip())
+            return
+
+        print("Documented commands:")
+        print(' '.join(sorted(name for name in self._cmds if name != 'EOF')))
+
     def do_eval(self, arg):
         """
         Eval the given expression
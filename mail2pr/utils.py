@@ -1,17 +1,47 @@
-import re
 import os
 import subprocess
+import shutil
 import logging
-from typing import Union, List
-from tempfile import TemporaryDirectory
+from typing import BinaryIO, Optional, Union, List
+from tempfile import TemporaryDirectory, mkdtemp
 from pathlib import Path
 
 logger = logging.getLogger(__name__)
 
+_REPLY_PREFIXES = ("re:", "aw:", "fwd:")
+_SLUG_TABLE = bytes(
+    c if chr(c).isascii() and chr(c).isalnum() else ord(' ') for c in range(256)
+)
 
-def sh(command: List[str], cwd=None, input=None, check=True, stdout=None, text=None):
-    logging.info("$ " + ' '.join(command))
-    return subprocess.run(command, check=check, cwd=cwd, input=input, stdout=stdout, text=text)
+
+def sh(command: List[str], cwd=None, input=None, check=True, stdout=None, text=None,
+       input_file: Optional[BinaryIO] = None):
+    """
+    Run the given command. `input_file` is streamed to the command's stdin
+    in chunks instead of being passed as one big `input` buffer.
+    """
+    if logger.isEnabledFor(logging.INFO):
+        logger.info("$ %s", ' '.join(map(str, command)))
+
+    if input_file is None:
+        return subprocess.run(command, check=check, cwd=cwd, input=input, stdout=stdout, text=text)
+
+    if input is not None or stdout is not None:
+        raise ValueError("input_file can not be combined with input or stdout")
+
+    with subprocess.Popen(command, cwd=cwd, stdin=subprocess.PIPE) as proc:
+        try:
+            shutil.copyfileobj(input_file, proc.stdin, 64 * 1024)
+            # closing flushes the remaining buffer and can fail just the same
+            proc.stdin.close()
+        except BrokenPipeError:
+            # the command exited early, its return code tells us why
+            pass
+        returncode = proc.wait()
+
+    if check and returncode != 0:
+        raise subprocess.CalledProcessError(returncode, command)
+    return subprocess.CompletedProcess(command, returncode)
 
 
 def trim_subject(subject: str) -> str:
@@ -19,16 +49,22 @@ def trim_subject(subject: str) -> str:
     Return the subject without leading/trailling whitespaces and mail specific prefixes.
     """
     subject = subject.strip()
-    subject = subject.lstrip('Re:').lstrip()
-    subject = subject.lstrip('re:').lstrip()
-    subject = subject.lstrip(':').lstrip()
-    if subject.startswith('['):
-        # strip [PATCH] and other prefixes in brackets
-        m = re.match(r"^\[[^\]]+\](?P<subject>.+)$", subject)
-        if m:
-            subject = m.group('subject').strip()
+    while True:
+        lowered = subject[:4].lower()
+        prefix = next((p for p in _REPLY_PREFIXES if lowered.startswith(p)), None)
+        if prefix is not None:
+            subject = subject[len(prefix):].lstrip()
+            continue
 
-    return subject
+        if subject.startswith('['):
+            # strip [PATCH] and other prefixes in brackets unless nothing would be left
+            end = subject.find(']')
+            rest = subject[end + 1:].lstrip() if end > 0 else ''
+            if rest:
+                subject = rest
+                continue
+
+        return subject
 
 
 def slugify_subject(subject: str) -> str:
@@ -38,15 +74,38 @@ def slugify_subject(subject: str) -> str:
 
     subject = trim_subject(subject)
 
-    # finally replace everything that isn't 0-9a-bA-B with -
-    subject = re.sub(r"[^0-9a-zA-Z]", "-", subject)
-    # remove double/triple/… dashes
-    subject = re.sub(r"--+", "-", subject)
-    # remoe dashes at the start and the end
-    subject = re.sub(r"^-", "", subject)
-    subject = re.sub(r"-$", "", subject)
+    # turn everything that isn't 0-9a-zA-Z into whitespace, split() then
+    # drops runs of it as well as any at the start and the end in one go
+    slug = subject.encode('ascii', 'replace').translate(_SLUG_TABLE)
+    return b'-'.join(slug.split()).decode()
+
 
-    return subject
+def remove_tree_in_background(path: Path):
+    """
+    Remove the given directory without waiting for it to be gone.
+
+    The directory is renamed out of the way first so that the original path
+    is free immediately, the actual removal is left to an `rm -rf` that is
+    detached from this process.
+    """
+    try:
+        # replacing the fresh, empty directory is atomic and can't clash
+        trash = mkdtemp(prefix=f".{path.name}.dead.{os.getpid()}.", dir=path.parent)
+        os.replace(path, trash)
+    except OSError:
+        logger.debug("Falling back to a synchronous removal of %s", path, exc_info=True)
+        shutil.rmtree(str(path))
+        return
+
+    try:
+        # The shell only backgrounds rm and exits right away, so there is no
+        # child left for us to reap and rm keeps running after we are gone.
+        subprocess.run(["sh", "-c", 'rm -rf -- "$1" &', "sh", trash], check=True,
+                       start_new_session=True, stdin=subprocess.DEVNULL,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    except (OSError, subprocess.CalledProcessError):
+        logger.debug("Falling back to a synchronous removal of %s", trash, exc_info=True)
+        shutil.rmtree(trash)
 
 
 def create_cache_directory(name: str) -> Union[Path, "TemporaryDirectory[str]"]:
@@ -1,8 +1,12 @@
 import pytest
-from mail2pr import Mail
-from mail2pr.utils import slugify_subject
+from mail2pr import Mail, Shell
+from mail2pr.utils import slugify_subject, trim_subject, sh, create_cache_directory, \
+    remove_tree_in_background
 from pathlib import Path
 import os
+import io
+import subprocess
+import time
 
 
 FIXTURE_DIR = Path(
@@ -32,6 +36,118 @@ def test_get_slug():
     ("[PATCHv2] add some amazing feature", "add-some-amazing-feature"),
     ("Re: [PATCHv2] add some amazing feature", "add-some-amazing-feature"),
     ("Re: [PATCHv2] add some amazing feature 👾", "add-some-amazing-feature"),
+    ("Re: Re: [PATCH 1/2] [RFC] add some amazing feature", "add-some-amazing-feature"),
+    ("Reverse the order", "Reverse-the-order"),
 ])
 def test_slugify_subject(subject, slug):
     assert slugify_subject(subject) == slug
+
+
+@pytest.mark.parametrize('subject, trimmed', [
+    ("[PATCH] add some amazing feature", "add some amazing feature"),
+    ("RE: AW: Fwd: [PATCH] add some amazing feature", "add some amazing feature"),
+    ("Re: [PATCH 1/2] Re: [RFC] add some amazing feature", "add some amazing feature"),
+    ("Reverse: the order", "Reverse: the order"),
+    ("[PATCH]", "[PATCH]"),
+])
+def test_trim_subject(subject, trimmed):
+    assert trim_subject(subject) == trimmed
+
+
+def test_headers_without_body():
+    mail = Mail(io.BytesIO(b"Subject: [PATCH] no body\r\nMessage-Id: <foo@bar>\r\n"))
+    assert mail.message_id == "<foo@bar>"
+    assert mail.slug == "no-body"
+
+
+def test_body_is_not_parsed_as_headers():
+    mail = Mail(io.BytesIO(b"Subject: foo\n\nSubject: bar\nMessage-Id: <foo@bar>\n"))
+    assert mail.subject == "foo"
+    assert mail.message_id is None
+
+
+def test_as_bytes_is_verbatim():
+    path = FIXTURE_DIR / "1608054753.R10639372170588705026.wrt"
+    with open(path, 'rb') as fh:
+        mail = Mail(fh)
+    assert mail.as_bytes() == path.read_bytes()
+    assert mail.open_bytes().read() == path.read_bytes()
+    assert mail.open_bytes().read() == path.read_bytes()
+
+
+def test_sh_streams_input_file():
+    res = sh(["sh", "-c", 'test "$(cat)" = hello'], input_file=io.BytesIO(b"hello"))
+    assert res.returncode == 0
+
+    with pytest.raises(subprocess.CalledProcessError):
+        sh(["false"], input_file=io.BytesIO(b"hello"))
+
+
+def test_sh_input_file_command_exits_early():
+    # much larger than the pipe buffer so writing fails once the command is gone
+    data = b"x" * (16 * 1024 * 1024)
+    assert sh(["true"], input_file=io.BytesIO(data)).returncode == 0
+
+    with pytest.raises(subprocess.CalledProcessError):
+        sh(["false"], input_file=io.BytesIO(data))
+
+
+def test_cache_directories_do_not_clash(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+
+    assert create_cache_directory("slug") == tmp_path / "mail2pr" / "slug"
+    assert create_cache_directory("slug") == tmp_path / "mail2pr" / "slug-1"
+
+
+def test_remove_tree_in_background(tmp_path):
+    path = tmp_path / "slug"
+    (path / "repo" / "nested").mkdir(parents=True)
+    (path / "repo" / "nested" / "file").write_text("content")
+
+    remove_tree_in_background(path)
+    assert not path.exists()
+
+    deadline = time.monotonic() + 10
+    while any(tmp_path.iterdir()) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert list(tmp_path.iterdir()) == []
+
+
+class FakeWorktree:
+    def __init__(self):
+        self.calls = []
+
+    def eval(self, expression):
+        self.calls.append(("eval", expression))
+
+    def shell(self):
+        self.calls.append(("shell",))
+
+
+def run_shell(monkeypatch, lines):
+    lines = iter(lines)
+
+    def fake_input(prompt):
+        try:
+            return next(lines)
+        except StopIteration:
+            raise EOFError
+
+    monkeypatch.setattr("builtins.input", fake_input)
+    worktree = FakeWorktree()
+    Shell(worktree, None).cmdloop()
+    return worktree
+
+
+def test_shell_dispatches_commands(monkeypatch, capsys):
+    worktree = run_shell(monkeypatch, ["", "eval  default.nix ", "!", "bogus arg", "?eval"])
+    assert worktree.calls == [("eval", "default.nix"), ("shell",)]
+
+    out = capsys.readouterr().out
+    assert "*** Unknown syntax: bogus arg" in out
+    assert "Eval the given expression" in out
+
+
+def test_shell_quit_stops_reading(monkeypatch):
+    worktree = run_shell(monkeypatch, ["quit", "eval default.nix"])
+    assert worktree.calls == []